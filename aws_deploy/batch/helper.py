@@ -1,8 +1,9 @@
-from typing import List
+from typing import List, TYPE_CHECKING
 
 import click
-from boto3 import Session
-from boto3_type_annotations import batch
+
+if TYPE_CHECKING:
+    from boto3_type_annotations import batch
 
 
 class Diff:
@@ -100,6 +101,8 @@ class BatchContainerProperties:
 class BatchClient:
     def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None,
                  profile_name=None):
+        from boto3.session import Session
+
         session = Session(
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
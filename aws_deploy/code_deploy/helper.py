@@ -1,16 +1,17 @@
 import hashlib
 import json
-from typing import List, Optional
+from typing import List, Optional, TYPE_CHECKING
 
 import click
-from boto3 import Session
-from boto3_type_annotations import codedeploy
-from boto3_type_annotations import ecs
-from boto3_type_annotations import resourcegroupstaggingapi
 from botocore.exceptions import ClientError
 
 from aws_deploy.ecs.helper import EcsTaskDefinition, EcsService
 
+if TYPE_CHECKING:
+    from boto3_type_annotations import codedeploy
+    from boto3_type_annotations import ecs
+    from boto3_type_annotations import resourcegroupstaggingapi
+
 
 class Diff:
     def __init__(self, field, value, old_value):
@@ -280,6 +281,8 @@ class CodeDeployDeployment:
 class CodeDeployClient:
     def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None,
                  profile_name=None):
+        from boto3.session import Session
+
         session = Session(
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
@@ -351,7 +354,7 @@ class CodeDeployClient:
             task_definition = self.get_task_definition(task_definition_arn=task_definition_arns[0])
             module_version = task_definition.get_tag('ModuleVersion')
             click.secho(f'Found Task [Family={family}, ModuleVersion={module_version}]')
-            return self.get_task_definition(task_definition_arn=task_definition_arns[0])
+            return task_definition
 
         raise UnknownTaskDefinitionError(f'Task not found [Family={family}, ModuleVersion={module_version}]')
 
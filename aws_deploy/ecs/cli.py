@@ -169,10 +169,10 @@ def rollback_task_definition(deployment, old_td, new_td, timeout=600, sleep_time
 
 def print_diff(task_definition, title='Updating task definition'):
     if task_definition.diff:
-        click.secho(title)
-        for diff in task_definition.diff:
-            click.secho(str(diff), fg='blue')
-        click.secho('')
+        lines = [f'{title}\n']
+        lines.extend(click.style(str(diff), fg='blue') + '\n' for diff in task_definition.diff)
+        lines.append('\n')
+        click.echo(''.join(lines), nl=False)
 
 
 def inspect_errors(service, failure_message, ignore_warnings, since, timeout):
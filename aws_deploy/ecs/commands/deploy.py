@@ -65,14 +65,21 @@ def deploy(ctx, cluster, service, task, image, tag, command, env, env_file, secr
         ecs_client = get_ecs_client(ctx)
         deploy_action = DeployAction(ecs_client, cluster, service)
 
-        # fetch task definition
-        requested_ecs_service = deploy_action.get_service()
+        # fetch task definition, the service has already been described by the action
+        requested_ecs_service = deploy_action.service
         click.secho(f'Fetching task definition [service_name={requested_ecs_service.name}]-> ', nl=False)
         current_task_definition_arn = requested_ecs_service.task_definition
 
-        last_task_definition = get_task_definition(deploy_action,
-            task=current_task_definition_arn.rsplit(':', 1)[0]
-        )
+        if module_version:
+            last_task_definition = get_task_definition(
+                deploy_action, task=current_task_definition_arn.rsplit(':', 1)[0]
+            )
+            current_task_definition = None
+        else:
+            # the current revision is needed for its ModuleVersion, fetch both at once
+            last_task_definition, current_task_definition = deploy_action.get_task_definitions(
+                current_task_definition_arn.rsplit(':', 1)[0], current_task_definition_arn
+            )
         requested_task_definition_arn = last_task_definition.arn
         click.secho(f'{requested_task_definition_arn}', fg='green')
 
@@ -86,9 +93,6 @@ def deploy(ctx, cluster, service, task, image, tag, command, env, env_file, secr
             requested_module_version = module_version
         else:
             click.secho('ModuleVersion not present, fetching it -> ', nl=False)
-            current_task_definition = get_task_definition(deploy_action,
-                task=current_task_definition_arn
-            )
             requested_module_version = current_task_definition.get_tag('ModuleVersion')
             click.secho(f'{requested_module_version}', fg='green')
 
@@ -111,9 +115,8 @@ def deploy(ctx, cluster, service, task, image, tag, command, env, env_file, secr
 
         # skip latest tag
         if 'latest' in selected_tag:
-            current_task_definition = get_task_definition(deploy_action,
-                task=current_task_definition_arn
-            )
+            if current_task_definition is None:
+                current_task_definition = get_task_definition(deploy_action, task=current_task_definition_arn)
             selected_tag = list(current_task_definition.images)[0][1].rsplit(':', 1)[1]
 
             if 'latest' in selected_tag:
@@ -1,50 +1,125 @@
 import json
-import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import cached_property
+from itertools import chain
 from json.decoder import JSONDecodeError
+from typing import TYPE_CHECKING
 
 import click
-from boto3.session import Session
-from boto3_type_annotations.ecs import Client
-from boto3_type_annotations import resourcegroupstaggingapi
 from botocore.exceptions import ClientError, NoCredentialsError
 from dateutil.tz.tz import tzlocal
-from dictdiffer import diff
 
-JSON_LIST_REGEX = re.compile(r'^\[.*\]$')
+if TYPE_CHECKING:
+    from boto3_type_annotations.ecs import Client
+    from boto3_type_annotations import resourcegroupstaggingapi
 
 LAUNCH_TYPE_EC2 = 'EC2'
 LAUNCH_TYPE_FARGATE = 'FARGATE'
 
+DESCRIBE_TASKS_MAX_RESULTS = 100
+DESCRIBE_TASKS_MAX_WORKERS = 8
+
+CLIENT_MAX_POOL_CONNECTIONS = 25
+CLIENT_RETRIES = {'mode': 'adaptive', 'max_attempts': 10}
+
+_TZLOCAL = tzlocal()
+
+# boto3 sessions are reused across clients with the same credentials, so
+# service models and credentials are only loaded once per process
+_sessions = {}
+
 
 def read_env_file(container_name, file):
     env_vars = []
     try:
         with open(file) as f:
             for line in f:
-                if line.startswith('#') or not line.strip() or '=' not in line:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
                     continue
-                key, value = line.strip().split('=', 1)
+                key, _, value = line.partition('=')
                 env_vars.append((container_name, key, value))
     except Exception as e:
         raise EcsTaskDefinitionCommandError(str(e))
     return tuple(env_vars)
 
 
+def _diff_node(path):
+    if all(isinstance(key, str) and '.' not in key for key in path):
+        return '.'.join(path)
+    return list(path)
+
+
+def _diff(first, second, path=()):
+    """
+    Recursive diff of two values as dictdiffer-style (action, node, payload) tuples,
+    dicts are compared by key and lists by index.
+    """
+    if isinstance(first, dict) and isinstance(second, dict):
+        common = [key for key in first if key in second]
+        added = [key for key in second if key not in first]
+        removed = [key for key in first if key not in second]
+    elif isinstance(first, list) and isinstance(second, list):
+        shortest = min(len(first), len(second))
+        common = range(shortest)
+        added = range(shortest, len(second))
+        removed = reversed(range(shortest, len(first)))
+    else:
+        if first != second:
+            yield 'change', _diff_node(path), (first, second)
+        return
+
+    for key in common:
+        yield from _diff(first[key], second[key], path + (key,))
+
+    added = [(key, second[key]) for key in added]
+    if added:
+        yield 'add', _diff_node(path), added
+
+    removed = [(key, first[key]) for key in removed]
+    if removed:
+        yield 'remove', _diff_node(path), removed
+
+
+def _normalize_container(container):
+    # copy instead of mutating the container definition, which is still used for registering
+    return {
+        **container,
+        'environment': {e['name']: e['value'] for e in container.get('environment', ())},
+        'secrets': {s['name']: s['valueFrom'] for s in container.get('secrets', ())},
+    }
+
+
+def _task_definition_revision(task_definition_arn):
+    return int(task_definition_arn[task_definition_arn.rindex(':') + 1:])
+
+
 class EcsClient(object):
     def __init__(self, aws_access_key_id=None, aws_secret_access_key=None, aws_session_token=None, region_name=None,
                  profile_name=None):
-        session = Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            aws_session_token=aws_session_token,
-            region_name=region_name,
-            profile_name=profile_name
-        )
+        # imported on first use, boto3 is slow to import and not needed to parse the command line
+        from boto3.session import Session
+        from botocore.config import Config
+
+        session_key = (aws_access_key_id, aws_secret_access_key, aws_session_token, region_name, profile_name)
+        session = _sessions.get(session_key)
+        if session is None:
+            session = _sessions[session_key] = Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                aws_session_token=aws_session_token,
+                region_name=region_name,
+                profile_name=profile_name
+            )
 
-        self.boto: Client = session.client('ecs')
-        self.events = session.client('events')
-        self._resource_tagging: resourcegroupstaggingapi.Client = session.client('resourcegroupstaggingapi')
+        config = Config(max_pool_connections=CLIENT_MAX_POOL_CONNECTIONS, retries=CLIENT_RETRIES)
+
+        self.boto: Client = session.client('ecs', config=config)
+        self.events = session.client('events', config=config)
+        self._resource_tagging: resourcegroupstaggingapi.Client = session.client(
+            'resourcegroupstaggingapi', config=config
+        )
 
     def describe_services(self, cluster_name, service_name):
         return self.boto.describe_services(
@@ -76,25 +151,31 @@ class EcsClient(object):
             for next_patch_version in range(int(patch_version), int(patch_version) + 10)
         ]
 
-        response_payload = self._resource_tagging.get_resources(
+        paginator = self._resource_tagging.get_paginator('get_resources')
+        page_iterator = paginator.paginate(
             ResourceTypeFilters=['ecs:task-definition'],
             TagFilters=[
                 {'Key': 'Family', 'Values': [family]},
                 {'Key': 'ModuleVersion', 'Values': compatible_module_versions}
-            ]
+            ],
+            PaginationConfig={'PageSize': 100}
         )
 
-        task_definition_arns = sorted(
-            [item['ResourceARN'] for item in response_payload['ResourceTagMappingList']],
-            key=lambda x: int(x.rsplit(':', 1)[1]),  # sort by (int) version
-            reverse=True
+        # only the latest (int) revision is needed, no need to sort
+        task_definition_arn = max(
+            (
+                item['ResourceARN']
+                for item in chain.from_iterable(page['ResourceTagMappingList'] for page in page_iterator)
+            ),
+            key=_task_definition_revision,
+            default=None
         )
 
-        if task_definition_arns:
-            task_definition = self.get_task_definition(task_definition_arn=task_definition_arns[0])
+        if task_definition_arn:
+            task_definition = self.get_task_definition(task_definition_arn=task_definition_arn)
             module_version = task_definition.get_tag('ModuleVersion')
             click.secho(f'Found Task [Family={family}, ModuleVersion={module_version}]')
-            return self.get_task_definition(task_definition_arn=task_definition_arns[0])
+            return task_definition
 
         raise UnknownTaskDefinitionError(f'Task not found [Family={family}, ModuleVersion={module_version}]')
 
@@ -112,10 +193,14 @@ class EcsClient(object):
             )
 
     def list_tasks(self, cluster_name, service_name):
-        return self.boto.list_tasks(
+        paginator = self.boto.get_paginator('list_tasks')
+        page_iterator = paginator.paginate(
             cluster=cluster_name,
             serviceName=service_name
         )
+        return {
+            u'taskArns': list(chain.from_iterable(page[u'taskArns'] for page in page_iterator))
+        }
 
     def describe_tasks(self, cluster_name, task_arns):
         return self.boto.describe_tasks(cluster=cluster_name, tasks=task_arns)
@@ -206,6 +291,10 @@ class EcsService(dict):
     def __init__(self, cluster, service_definition=None, **kwargs):
         self._cluster = cluster
         super(EcsService, self).__init__(service_definition, **kwargs)
+        self._primary_deployment = next(
+            (d for d in self.get(u'deployments') or () if d.get(u'status') == u'PRIMARY'), None
+        )
+        self._warnings = {}
 
     def set_task_definition(self, task_definition):
         self[u'taskDefinition'] = task_definition.arn
@@ -228,17 +317,15 @@ class EcsService(dict):
 
     @property
     def deployment_created_at(self):
-        for deployment in self.get(u'deployments'):
-            if deployment.get(u'status') == u'PRIMARY':
-                return deployment.get(u'createdAt')
-        return datetime.now()
+        if self._primary_deployment:
+            return self._primary_deployment.get(u'createdAt')
+        return None
 
     @property
     def deployment_updated_at(self):
-        for deployment in self.get(u'deployments'):
-            if deployment.get(u'status') == u'PRIMARY':
-                return deployment.get(u'updatedAt')
-        return datetime.now()
+        if self._primary_deployment:
+            return self._primary_deployment.get(u'updatedAt')
+        return None
 
     @property
     def errors(self):
@@ -248,20 +335,36 @@ class EcsService(dict):
 
     @property
     def older_errors(self):
+        if not self._primary_deployment:
+            return {}
         return self.get_warnings(
             since=self.deployment_created_at,
             until=self.deployment_updated_at
         )
 
     def get_warnings(self, since=None, until=None):
+        # without a PRIMARY deployment there is no lower bound
         since = since or self.deployment_created_at
-        until = until or datetime.now(tz=tzlocal())
+        # only bounded lookups are cached, an open end moves with the current time
+        cache_key = (since, until) if until else None
+        if cache_key in self._warnings:
+            return self._warnings[cache_key]
+
+        until = until or datetime.now(tz=_TZLOCAL)
         errors = {}
-        for event in self.get(u'events'):
-            if u'unable' not in event[u'message']:
+        # events are returned newest first, so stop at the first one older than since
+        for event in self.get(u'events') or ():
+            created_at = event[u'createdAt']
+            if since is not None and created_at <= since:
+                break
+            if created_at >= until:
                 continue
-            if since < event[u'createdAt'] < until:
-                errors[event[u'createdAt']] = event[u'message']
+            message = event[u'message']
+            if u'unable' in message:
+                errors[created_at] = message
+
+        if cache_key:
+            self._warnings[cache_key] = errors
         return errors
 
 
@@ -279,6 +382,8 @@ class EcsTaskDefinition(object):
         self.role_arn = taskRoleArn or ''
         self.execution_role_arn = executionRoleArn or ''
         self.tags = tags
+        self._tag_index = None
+        self._container_index = {container['name']: container for container in containerDefinitions}
         self.additional_properties = {k: v for k,v in kwargs.items() if k not in ("registeredAt", "registeredBy")}
         self._diff = []
 
@@ -287,10 +392,9 @@ class EcsTaskDefinition(object):
         # task definition. Just storing it for now.
         self.compatibilities = compatibilities
 
-    @property
+    @cached_property
     def container_names(self):
-        for container in self.containers:
-            yield container['name']
+        return frozenset(self._container_index)
 
     @property
     def images(self):
@@ -311,34 +415,19 @@ class EcsTaskDefinition(object):
 
     def show_diff(self, show_diff: bool = False):
         if show_diff:
-            click.secho('Task definition modified:')
-            for d in self._diff:
-                click.secho(f'    {str(d)}', fg='blue')
-            click.secho('')
+            # build the whole output first, one write instead of one per diff
+            lines = ['Task definition modified:\n']
+            lines.extend(click.style(f'    {str(d)}', fg='blue') + '\n' for d in self._diff)
+            lines.append('\n')
+            click.echo(''.join(lines), nl=False)
 
     def diff_raw(self, task_b):
-        containers_a = {c['name']: c for c in self.containers}
-        containers_b = {c['name']: c for c in task_b.containers}
+        containers_a = {c['name']: _normalize_container(c) for c in self.containers}
+        containers_b = {c['name']: _normalize_container(c) for c in task_b.containers}
 
         requirements_a = sorted([r['name'] for r in self.requires_attributes])
         requirements_b = sorted([r['name'] for r in task_b.requires_attributes])
 
-        for container in containers_a:
-            containers_a[container]['environment'] = {e['name']: e['value'] for e in
-                                                      containers_a[container].get('environment', {})}
-
-        for container in containers_b:
-            containers_b[container]['environment'] = {e['name']: e['value'] for e in
-                                                      containers_b[container].get('environment', {})}
-
-        for container in containers_a:
-            containers_a[container]['secrets'] = {e['name']: e['valueFrom'] for e in
-                                                  containers_a[container].get('secrets', {})}
-
-        for container in containers_b:
-            containers_b[container]['secrets'] = {e['name']: e['valueFrom'] for e in
-                                                  containers_b[container].get('secrets', {})}
-
         composite_a = {
             'containers': containers_a,
             'volumes': self.volumes,
@@ -359,7 +448,7 @@ class EcsTaskDefinition(object):
             'additional_properties': task_b.additional_properties,
         }
 
-        return list(diff(composite_a, composite_b))
+        return list(_diff(composite_a, composite_b))
 
     def get_overrides(self):
         override = dict()
@@ -378,7 +467,7 @@ class EcsTaskDefinition(object):
 
     @staticmethod
     def parse_command(command):
-        if re.match(JSON_LIST_REGEX, command):
+        if command.lstrip()[:1] == '[' and command.rstrip()[-1:] == ']':
             try:
                 return json.loads(command)
             except JSONDecodeError as e:
@@ -394,55 +483,62 @@ class EcsTaskDefinition(object):
 
     @staticmethod
     def get_overrides_env(env):
-        return [{"name": e, "value": env[e]} for e in env]
+        return [{"name": name, "value": value} for name, value in env.items()]
 
     @staticmethod
     def get_overrides_secrets(secrets):
-        return [{"name": s, "valueFrom": secrets[s]} for s in secrets]
+        return [{"name": name, "valueFrom": value_from} for name, value_from in secrets.items()]
 
-    def get_tag(self, key):
-        for tag in self.tags:
-            if tag['key'] == key:
-                return tag['value']
+    @property
+    def _tags_by_key(self):
+        if self._tag_index is None:
+            self._tag_index = {tag['key']: tag for tag in (self.tags or [])}
+        return self._tag_index
 
-        return None
+    def get_tag(self, key):
+        tag = self._tags_by_key.get(key)
+        return tag['value'] if tag else None
 
     def set_tag(self, key: str, value: str):
         if key and value:
-            done = False
-            for tag in self.tags:
-                if tag['key'] == key:
-                    if tag['value'] != value:
-                        diff = EcsTaskDefinitionDiff(
-                            container=None,
-                            field=f"tags['{key}']",
-                            value=value,
-                            old_value=tag['value']
-                        )
-                        self._diff.append(diff)
-                        tag['value'] = value
-                    done = True
-                    break
-
-            if not done:
+            tag = self._tags_by_key.get(key)
+            if tag:
+                if tag['value'] != value:
+                    diff = EcsTaskDefinitionDiff(
+                        container=None,
+                        field=f"tags['{key}']",
+                        value=value,
+                        old_value=tag['value']
+                    )
+                    self._diff.append(diff)
+                    tag['value'] = value
+            else:
                 diff = EcsTaskDefinitionDiff(container=None, field=f"tags['{key}']", value=value, old_value=None)
                 self._diff.append(diff)
-                self.tags.append({'key': key, 'value': value})
+                tag = {'key': key, 'value': value}
+                if self.tags is None:
+                    self.tags = []
+                self.tags.append(tag)
+                self._tags_by_key[key] = tag
 
     def set_images(self, tag=None, **images):
         self.validate_container_options(**images)
-        for container in self.containers:
-            if container['name'] in images:
-                new_image = images[container['name']]
-                diff = EcsTaskDefinitionDiff(
-                    container=container['name'],
-                    field='image',
-                    value=new_image,
-                    old_value=container['image']
-                )
-                self._diff.append(diff)
-                container['image'] = new_image
-            elif tag:
+        for container_name, new_image in images.items():
+            container = self._container_index[container_name]
+            diff = EcsTaskDefinitionDiff(
+                container=container_name,
+                field='image',
+                value=new_image,
+                old_value=container['image']
+            )
+            self._diff.append(diff)
+            container['image'] = new_image
+
+        if tag:
+            for container in self.containers:
+                if container['name'] in images:
+                    continue
+
                 image_definition = container['image'].rsplit(':', 1)
                 new_image = f'{image_definition[0]}:{tag.strip()}'
 
@@ -459,52 +555,56 @@ class EcsTaskDefinition(object):
 
     def set_commands(self, **commands):
         self.validate_container_options(**commands)
-        for container in self.containers:
-            if container['name'] in commands:
-                new_command = commands[container['name']]
-                diff = EcsTaskDefinitionDiff(
-                    container=container['name'],
-                    field='command',
-                    value=new_command,
-                    old_value=container.get('command')
-                )
-                self._diff.append(diff)
-                container['command'] = self.parse_command(new_command)
+        for container_name, new_command in commands.items():
+            container = self._container_index[container_name]
+            diff = EcsTaskDefinitionDiff(
+                container=container_name,
+                field='command',
+                value=new_command,
+                old_value=container.get('command')
+            )
+            self._diff.append(diff)
+            container['command'] = self.parse_command(new_command)
 
     def set_environment(self, environment_list, exclusive=False, env_file=((None, None),)):
         environment = {}
         if None not in env_file[0]:
-            for env in env_file:
-                line = read_env_file(env[0], env[1])
-                environment_list = line + environment_list
-        for env in environment_list:
-            environment.setdefault(env[0], {})
-            environment[env[0]][env[1]] = env[2]
+            # earlier env files take precedence over later ones, explicit variables over all of them
+            environment_list = chain.from_iterable((
+                *(read_env_file(env[0], env[1]) for env in reversed(env_file)),
+                environment_list
+            ))
+        for container_name, name, value in environment_list:
+            environment.setdefault(container_name, {})[name] = value
 
         self.validate_container_options(**environment)
-        for container in self.containers:
-            if container['name'] in environment:
-                self.apply_container_environment(
-                    container=container,
-                    new_environment=environment[container['name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_environment(
-                    container=container,
-                    new_environment={},
-                    exclusive=exclusive,
-                )
+        for container_name, new_environment in environment.items():
+            self.apply_container_environment(
+                container=self._container_index[container_name],
+                new_environment=new_environment,
+                exclusive=exclusive,
+            )
+
+        if exclusive is True:
+            for container in self.containers:
+                if container['name'] not in environment:
+                    self.apply_container_environment(
+                        container=container,
+                        new_environment={},
+                        exclusive=exclusive,
+                    )
 
     def apply_container_environment(self, container, new_environment, exclusive=False):
+        if not new_environment and exclusive is not True:
+            return
+
         environment = container.get('environment', {})
         old_environment = {env['name']: env['value'] for env in environment}
 
         if exclusive is True:
             merged = new_environment
         else:
-            merged = old_environment.copy()
-            merged.update(new_environment)
+            merged = old_environment | new_environment
 
         if old_environment == merged:
             return
@@ -518,7 +618,7 @@ class EcsTaskDefinition(object):
         self._diff.append(diff)
 
         container['environment'] = [
-            {"name": e, "value": merged[e]} for e in merged
+            {"name": name, "value": value} for name, value in merged.items()
         ]
 
     def set_secrets(self, secrets_list, exclusive=False):
@@ -529,29 +629,33 @@ class EcsTaskDefinition(object):
             secrets[secret[0]][secret[1]] = secret[2]
 
         self.validate_container_options(**secrets)
-        for container in self.containers:
-            if container['name'] in secrets:
-                self.apply_container_secrets(
-                    container=container,
-                    new_secrets=secrets[container['name']],
-                    exclusive=exclusive,
-                )
-            elif exclusive is True:
-                self.apply_container_secrets(
-                    container=container,
-                    new_secrets={},
-                    exclusive=exclusive,
-                )
+        for container_name, new_secrets in secrets.items():
+            self.apply_container_secrets(
+                container=self._container_index[container_name],
+                new_secrets=new_secrets,
+                exclusive=exclusive,
+            )
+
+        if exclusive is True:
+            for container in self.containers:
+                if container['name'] not in secrets:
+                    self.apply_container_secrets(
+                        container=container,
+                        new_secrets={},
+                        exclusive=exclusive,
+                    )
 
     def apply_container_secrets(self, container, new_secrets, exclusive=False):
+        if not new_secrets and exclusive is not True:
+            return
+
         secrets = container.get('secrets', {})
         old_secrets = {secret['name']: secret['valueFrom'] for secret in secrets}
 
         if exclusive is True:
             merged = new_secrets
         else:
-            merged = old_secrets.copy()
-            merged.update(new_secrets)
+            merged = old_secrets | new_secrets
 
         if old_secrets == merged:
             return
@@ -565,13 +669,13 @@ class EcsTaskDefinition(object):
         self._diff.append(diff)
 
         container['secrets'] = [
-            {"name": s, "valueFrom": merged[s]} for s in merged
+            {"name": name, "valueFrom": value_from} for name, value_from in merged.items()
         ]
 
     def validate_container_options(self, **container_options):
-        for container_name in container_options:
-            if container_name not in self.container_names:
-                raise UnknownContainerError(f'Unknown container: {container_name}')
+        unknown_containers = container_options.keys() - self.container_names
+        if unknown_containers:
+            raise UnknownContainerError(f'Unknown container: {", ".join(sorted(unknown_containers))}')
 
     def set_role_arn(self, role_arn):
         if role_arn:
@@ -597,6 +701,9 @@ class EcsTaskDefinition(object):
 
 
 class EcsTaskDefinitionDiff(object):
+    # one instance per changed field, keep them small
+    __slots__ = ('container', 'field', 'value', 'old_value')
+
     def __init__(self, container, field, value, old_value):
         self.container = container
         self.field = field
@@ -696,6 +803,11 @@ class EcsAction(object):
         )
         return task_definition
 
+    def get_task_definitions(self, *task_definitions):
+        # independent DescribeTaskDefinition calls, overlap their round trips
+        with ThreadPoolExecutor(max_workers=max(1, len(task_definitions))) as executor:
+            return list(executor.map(self.get_task_definition, task_definitions))
+
     def update_task_definition(self, task_definition):
         response = self._client.register_task_definition(
             family=task_definition.family,
@@ -738,17 +850,27 @@ class EcsAction(object):
         return service.desired_count == running_count
 
     def get_running_tasks_count(self, service, task_arns):
-        running_count = 0
-        tasks_details = self._client.describe_tasks(
-            cluster_name=self._cluster_name,
-            task_arns=task_arns
+        # DescribeTasks accepts at most 100 tasks per call
+        chunks = [
+            task_arns[i:i + DESCRIBE_TASKS_MAX_RESULTS]
+            for i in range(0, len(task_arns), DESCRIBE_TASKS_MAX_RESULTS)
+        ]
+        if not chunks:
+            return 0
+
+        def describe_tasks(chunk):
+            return self._client.describe_tasks(cluster_name=self._cluster_name, task_arns=chunk)
+
+        if len(chunks) == 1:
+            tasks_details = [describe_tasks(chunks[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(DESCRIBE_TASKS_MAX_WORKERS, len(chunks))) as executor:
+                tasks_details = list(executor.map(describe_tasks, chunks))
+
+        return sum(
+            1 for task in chain.from_iterable(details[u'tasks'] for details in tasks_details)
+            if task[u'taskDefinitionArn'] == service.task_definition and task[u'lastStatus'] == u'RUNNING'
         )
-        for task in tasks_details[u'tasks']:
-            arn = task[u'taskDefinitionArn']
-            status = task[u'lastStatus']
-            if arn == service.task_definition and status == u'RUNNING':
-                running_count += 1
-        return running_count
 
     @property
     def client(self):
@@ -102,6 +102,25 @@ def test_client_get_task_definition(client: CodeDeployClient):
     )
 
 
+def test_client_get_task_definition_filtered(client: CodeDeployClient):
+    client._ecs.describe_task_definition.return_value = TASK_DEFINITION_PAYLOAD
+    client._resource_tagging.get_resources.return_value = {
+        'ResourceTagMappingList': [
+            {'ResourceARN': 'arn:aws:ecs:eu-west-1:123456789012:task-definition/test-task:1'},
+        ]
+    }
+
+    task_definition = client.get_task_definition_filtered('test-task', '1.0.0')
+
+    assert task_definition.arn == 'arn:aws:ecs:eu-west-1:123456789012:task-definition/test-task:1'
+    client._ecs.describe_task_definition.assert_called_once_with(
+        taskDefinition='arn:aws:ecs:eu-west-1:123456789012:task-definition/test-task:1',
+        include=[
+            'TAGS',
+        ]
+    )
+
+
 def test_client_get_unknown_task_definition(client: CodeDeployClient):
     error_response = {'Error': {'Code': 'ClientException', 'Message': 'Unable to describe task definition.'}}
     client._ecs.describe_task_definition.side_effect = ClientError(error_response, 'DescribeServices')
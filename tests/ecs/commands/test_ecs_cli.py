@@ -1,3 +1,4 @@
+from copy import deepcopy
 from datetime import datetime
 
 import pytest
@@ -11,7 +12,7 @@ from aws_deploy.ecs.helper import EcsClient
 from tests.ecs.utils import EcsTestClient
 from tests.ecs.constants import (
     CLUSTER_NAME, SERVICE_NAME, TASK_DEFINITION_ARN_2, TASK_DEFINITION_ARN_1, TASK_DEFINITION_FAMILY_1,
-    TASK_DEFINITION_REVISION_1, TASK_DEFINITION_REVISION_3
+    TASK_DEFINITION_REVISION_1, TASK_DEFINITION_REVISION_3, PAYLOAD_TASK_DEFINITION_1
 )
 
 
@@ -1082,6 +1083,38 @@ def test_diff(get_ecs_client, runner):
     assert '+ newvar: "new value"' in result.output
 
 
+@patch('aws_deploy.ecs.commands.diff.get_ecs_client')
+def test_diff_nested_properties(get_ecs_client, runner):
+    payload_a = deepcopy(PAYLOAD_TASK_DEFINITION_1)
+    payload_a[u'containerDefinitions'][0][u'portMappings'] = [{u'containerPort': 80, u'hostPort': 80}]
+    payload_a[u'containerDefinitions'][0][u'logConfiguration'] = {
+        u'logDriver': u'awslogs', u'options': {u'awslogs-group': u'webserver'}
+    }
+    payload_b = deepcopy(payload_a)
+    payload_b[u'containerDefinitions'][0][u'portMappings'][0][u'hostPort'] = 8080
+    payload_b[u'containerDefinitions'][0][u'logConfiguration'][u'options'][u'awslogs-group'] = u'web'
+    payload_b[u'volumes'] = [{u'name': u'data'}]
+
+    client = EcsTestClient('access_key', 'secret_key')
+    client.describe_task_definition = Mock(side_effect=[{u'taskDefinition': payload_a}, {u'taskDefinition': payload_b}])
+    get_ecs_client.return_value = client
+    result = runner.invoke(
+        diff.diff, (TASK_DEFINITION_FAMILY_1, str(TASK_DEFINITION_REVISION_1), str(TASK_DEFINITION_REVISION_3))
+    )
+
+    assert not result.exception
+    assert result.exit_code == 0
+
+    assert u"change: ['containers', 'webserver', 'portMappings', 0, 'hostPort']\n" \
+           u"    - 80\n" \
+           u"    + 8080\n" in result.output
+    assert u'change: containers.webserver.logConfiguration.options.awslogs-group\n' \
+           u'    - "webserver"\n' \
+           u'    + "web"\n' in result.output
+    assert u'add: volumes\n' \
+           u'    + 0: {"name": "data"}\n' in result.output
+
+
 @patch('aws_deploy.ecs.commands.diff.get_ecs_client')
 def test_diff_without_credentials(get_ecs_client, runner):
     get_ecs_client.return_value = EcsTestClient()
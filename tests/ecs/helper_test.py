@@ -7,8 +7,9 @@ import pytest
 from boto3.session import Session
 from botocore.exceptions import ClientError
 from dateutil.tz import tzlocal
-from mock import patch
+from mock import patch, ANY
 
+from aws_deploy.ecs import helper
 from aws_deploy.ecs.helper import (
     EcsTaskDefinition, EcsService, UnknownContainerError, EcsTaskDefinitionCommandError,
     EcsTaskDefinitionDiff, EcsClient, UnknownTaskDefinitionError, EcsAction, EcsConnectionError, DeployAction,
@@ -19,10 +20,19 @@ from tests.ecs.constants import (
     PAYLOAD_TASK_DEFINITION_1, PAYLOAD_TASK_DEFINITION_2, CLUSTER_NAME, PAYLOAD_SERVICE, PAYLOAD_SERVICE_WITH_ERRORS,
     PAYLOAD_SERVICE_WITHOUT_DEPLOYMENTS, DESIRED_COUNT, TASK_DEFINITION_ARN_1, SERVICE_NAME, TASK_DEFINITION_FAMILY_1,
     TASK_DEFINITION_CONTAINERS_2, TASK_DEFINITION_VOLUMES_2, TASK_DEFINITION_REVISION_1, RESPONSE_TASK_DEFINITION,
-    RESPONSE_SERVICE, RESPONSE_LIST_TASKS_1, RESPONSE_DESCRIBE_TASKS, RESPONSE_LIST_TASKS_0, TASK_ARN_1, TASK_ARN_2
+    RESPONSE_SERVICE, RESPONSE_LIST_TASKS_1, RESPONSE_DESCRIBE_TASKS, RESPONSE_LIST_TASKS_0, TASK_ARN_1, TASK_ARN_2,
+    TASK_DEFINITION_ARN_2, TASK_DEFINITION_ARN_3, RESPONSE_TASK_DEFINITION_3, TASK_DEFINITION_ROLE_ARN_1,
+    RESPONSE_TASK_DEFINITIONS, PAYLOAD_EVENTS
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_sessions():
+    helper._sessions.clear()
+    yield
+    helper._sessions.clear()
+
+
 @pytest.fixture()
 def task_definition():
     return EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_1))
@@ -74,15 +84,17 @@ def test_service_deployment_updated_at(service):
 
 
 def test_service_deployment_created_at_without_deployments(service_without_deployments):
-    now = datetime.now()
-    assert service_without_deployments.deployment_created_at >= now
-    assert service_without_deployments.deployment_created_at <= datetime.now()
+    assert service_without_deployments.deployment_created_at is None
 
 
 def test_service_deployment_updated_at_without_deployments(service_without_deployments):
-    now = datetime.now()
-    assert service_without_deployments.deployment_updated_at >= now
-    assert service_without_deployments.deployment_updated_at <= datetime.now()
+    assert service_without_deployments.deployment_updated_at is None
+
+
+def test_service_errors_without_deployments(service_without_deployments):
+    service_without_deployments[u'events'] = deepcopy(PAYLOAD_EVENTS)
+    assert len(service_without_deployments.errors) == 2
+    assert service_without_deployments.older_errors == {}
 
 
 def test_service_errors(service_with_errors):
@@ -133,6 +145,24 @@ def test_task_set_tag(task_definition):
         assert container[u'image'].endswith(u':foobar')
 
 
+def test_task_get_tag(task_definition):
+    assert task_definition.get_tag(u'ModuleVersion') is None
+
+    task_definition.set_tag(u'ModuleVersion', u'1.2.3')
+    assert task_definition.get_tag(u'ModuleVersion') == u'1.2.3'
+    assert task_definition.tags == [{u'key': u'ModuleVersion', u'value': u'1.2.3'}]
+
+
+def test_task_set_tag_existing(task_definition):
+    task_definition.set_tag(u'ModuleVersion', u'1.2.3')
+    task_definition.set_tag(u'ModuleVersion', u'1.2.4')
+    task_definition.set_tag(u'ModuleVersion', u'1.2.4')
+
+    assert task_definition.get_tag(u'ModuleVersion') == u'1.2.4'
+    assert task_definition.tags == [{u'key': u'ModuleVersion', u'value': u'1.2.4'}]
+    assert len(task_definition.diff) == 2
+
+
 def test_task_set_image(task_definition):
     task_definition.set_images(webserver=u'new-image:123', application=u'app-image:latest')
     for container in task_definition.containers:
@@ -164,6 +194,16 @@ def test_read_env_file_wrong_env_format():
     assert line == ()
 
 
+def test_read_env_file():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    tmp.write(b'  # indented comment\nfoo=bar\n  url=http://host/?a=1&b=2  \n')
+    tmp.read()
+    line = read_env_file('webserver', tmp.name)
+    os.unlink(tmp.name)
+    tmp.close()
+    assert line == (('webserver', 'foo', 'bar'), ('webserver', 'url', 'http://host/?a=1&b=2'))
+
+
 def test_env_file_wrong_file_name():
     with pytest.raises(EcsTaskDefinitionCommandError):
         read_env_file('webserver', 'WrongFileName')
@@ -190,6 +230,26 @@ def test_task_set_environment_from_e_and_env_file(task_definition):
         'environment']
 
 
+def test_task_set_environment_precedence_with_multiple_env_files(task_definition):
+    first = tempfile.NamedTemporaryFile(delete=False)
+    first.write(b'shared=first\nexplicit=first\nonly-first=1')
+    first.close()
+    second = tempfile.NamedTemporaryFile(delete=False)
+    second.write(b'shared=second\nonly-second=2')
+    second.close()
+
+    task_definition.set_environment(((u'webserver', u'explicit', u'cli'),),
+                                    env_file=((u'webserver', first.name), (u'webserver', second.name)))
+    os.unlink(first.name)
+    os.unlink(second.name)
+
+    environment = {e['name']: e['value'] for e in task_definition.containers[0]['environment']}
+    assert environment['shared'] == 'first'
+    assert environment['explicit'] == 'cli'
+    assert environment['only-first'] == '1'
+    assert environment['only-second'] == '2'
+
+
 def test_task_set_environment_from_env_file(task_definition):
     assert len(task_definition.containers[0]['environment']) == 3
 
@@ -281,6 +341,20 @@ def test_task_set_command_as_json_list(task_definition):
             assert container[u'command'] == [u'run-application', u'arg1', u'arg2']
 
 
+def test_task_set_command_as_json_list_with_surrounding_whitespace(task_definition):
+    task_definition.set_commands(webserver=u'  ["a", "b"]  ')
+    for container in task_definition.containers:
+        if container[u'name'] == u'webserver':
+            assert container[u'command'] == [u'a', u'b']
+
+
+def test_task_set_command_as_multiline_json_list(task_definition):
+    task_definition.set_commands(webserver=u'[\n    "run-webserver",\n    "arg1"\n]\n')
+    for container in task_definition.containers:
+        if container[u'name'] == u'webserver':
+            assert container[u'command'] == [u'run-webserver', u'arg1']
+
+
 def test_task_set_command_as_invalid_json_list(task_definition):
     with pytest.raises(EcsTaskDefinitionCommandError):
         task_definition.set_commands(webserver=u'["run-webserver, "arg1" arg2"]',
@@ -369,6 +443,30 @@ def test_task_definition_diff():
     assert str(diff) == u'Changed image of container "webserver" to: "new" (was: "old")'
 
 
+def test_task_definition_diff_raw(task_definition, task_definition_revision_2):
+    task_definition_revision_2.containers[0]['image'] = u'webserver:456'
+    task_definition_revision_2.containers.append({u'name': u'sidecar', u'image': u'sidecar:1'})
+    task_definition_revision_2.volumes = [{u'name': u'data'}]
+
+    result = task_definition.diff_raw(task_definition_revision_2)
+
+    assert ('change', 'containers.webserver.image', (u'webserver:123', u'webserver:456')) in result
+    sidecar = {u'name': u'sidecar', u'image': u'sidecar:1', u'environment': {}, u'secrets': {}}
+    assert ('add', 'containers', [(u'sidecar', sidecar)]) in result
+    assert ('add', 'volumes', [(0, {u'name': u'data'})]) in result
+    assert ('change', 'role_arn', (TASK_DEFINITION_ROLE_ARN_1, '')) in result
+
+
+def test_task_definition_diff_raw_keeps_containers(task_definition, task_definition_revision_2):
+    task_definition.diff_raw(task_definition_revision_2)
+    assert task_definition.containers == TASK_DEFINITION_CONTAINERS_2
+    assert task_definition_revision_2.containers == TASK_DEFINITION_CONTAINERS_2
+
+
+def test_task_definition_diff_raw_without_changes(task_definition):
+    assert task_definition.diff_raw(EcsTaskDefinition(**deepcopy(PAYLOAD_TASK_DEFINITION_1))) == []
+
+
 @patch.object(Session, 'client')
 @patch.object(Session, '__init__')
 def test_client_init(mocked_init, mocked_client):
@@ -383,8 +481,24 @@ def test_client_init(mocked_init, mocked_client):
         region_name=u'region',
         aws_session_token=u'session_token'
     )
-    mocked_client.assert_any_call(u'ecs')
-    mocked_client.assert_any_call(u'events')
+    mocked_client.assert_any_call(u'ecs', config=ANY)
+    mocked_client.assert_any_call(u'events', config=ANY)
+
+    config = mocked_client.call_args[1]['config']
+    assert config.max_pool_connections == 25
+    assert config.retries == {'mode': 'adaptive', 'max_attempts': 10}
+
+
+@patch.object(Session, 'client')
+@patch.object(Session, '__init__')
+def test_client_init_reuses_session(mocked_init, mocked_client):
+    mocked_init.return_value = None
+
+    EcsClient(u'reused_key_id', u'secret', u'token', u'region', u'profile')
+    EcsClient(u'reused_key_id', u'secret', u'token', u'region', u'profile')
+    EcsClient(u'other_key_id', u'secret', u'token', u'region', u'profile')
+
+    assert mocked_init.call_count == 2
 
 
 @pytest.fixture
@@ -413,9 +527,51 @@ def test_client_describe_unknown_task_definition(client):
         client.describe_task_definition(u'task_definition_arn')
 
 
+def test_client_get_task_definition_filtered(client):
+    response = deepcopy(RESPONSE_TASK_DEFINITION_3)
+    response[u'tags'] = [{u'key': u'ModuleVersion', u'value': u'1.2.4'}]
+    client.boto.describe_task_definition.return_value = response
+    client._resource_tagging.get_paginator.return_value.paginate.return_value = [
+        {u'ResourceTagMappingList': [{u'ResourceARN': TASK_DEFINITION_ARN_1}]},
+        {u'ResourceTagMappingList': [{u'ResourceARN': TASK_DEFINITION_ARN_3}, {u'ResourceARN': TASK_DEFINITION_ARN_2}]},
+    ]
+
+    task_definition = client.get_task_definition_filtered(TASK_DEFINITION_FAMILY_1, u'1.2.3')
+
+    assert task_definition.arn == TASK_DEFINITION_ARN_3
+    client._resource_tagging.get_paginator.assert_called_once_with('get_resources')
+    client._resource_tagging.get_paginator.return_value.paginate.assert_called_once_with(
+        ResourceTypeFilters=['ecs:task-definition'],
+        TagFilters=[
+            {'Key': 'Family', 'Values': [TASK_DEFINITION_FAMILY_1]},
+            {'Key': 'ModuleVersion', 'Values': [f'1.2.{patch_version}' for patch_version in range(3, 13)]}
+        ],
+        PaginationConfig={'PageSize': 100}
+    )
+    client.boto.describe_task_definition.assert_called_once_with(
+        taskDefinition=TASK_DEFINITION_ARN_3, include=['TAGS']
+    )
+
+
+def test_client_get_task_definition_filtered_not_found(client):
+    client._resource_tagging.get_paginator.return_value.paginate.return_value = [{u'ResourceTagMappingList': []}]
+    with pytest.raises(UnknownTaskDefinitionError):
+        client.get_task_definition_filtered(TASK_DEFINITION_FAMILY_1, u'1.2.3')
+
+
 def test_client_list_tasks(client):
-    client.list_tasks(u'test-cluster', u'test-service')
-    client.boto.list_tasks.assert_called_once_with(cluster=u'test-cluster', serviceName=u'test-service')
+    client.boto.get_paginator.return_value.paginate.return_value = [
+        {u'taskArns': [TASK_ARN_1]},
+        {u'taskArns': [TASK_ARN_2]},
+    ]
+
+    response = client.list_tasks(u'test-cluster', u'test-service')
+
+    assert response[u'taskArns'] == [TASK_ARN_1, TASK_ARN_2]
+    client.boto.get_paginator.assert_called_once_with('list_tasks')
+    client.boto.get_paginator.return_value.paginate.assert_called_once_with(
+        cluster=u'test-cluster', serviceName=u'test-service'
+    )
 
 
 def test_client_describe_tasks(client):
@@ -601,6 +757,19 @@ def test_ecs_action_get_current_task_definition(client, service):
     assert task_definition.arn == u'arn:aws:ecs:eu-central-1:123456789012:task-definition/test-task:1'
 
 
+@patch.object(EcsClient, '__init__')
+def test_ecs_action_get_task_definitions(client):
+    client.describe_task_definition.side_effect = lambda task_definition_arn: deepcopy(
+        RESPONSE_TASK_DEFINITIONS[task_definition_arn]
+    )
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+
+    task_definitions = action.get_task_definitions(TASK_DEFINITION_ARN_3, TASK_DEFINITION_ARN_1)
+
+    assert [td.arn for td in task_definitions] == [TASK_DEFINITION_ARN_3, TASK_DEFINITION_ARN_1]
+    assert client.describe_task_definition.call_count == 2
+
+
 @patch.object(EcsClient, '__init__')
 def test_update_task_definition(client, task_definition):
     client.register_task_definition.return_value = RESPONSE_TASK_DEFINITION
@@ -703,6 +872,29 @@ def test_get_running_tasks_count(client, service):
     assert running_count == 2
 
 
+@patch('aws_deploy.ecs.helper.ThreadPoolExecutor')
+@patch.object(EcsClient, '__init__')
+def test_get_running_tasks_count_single_batch_without_pool(client, thread_pool_executor, service):
+    client.describe_tasks.return_value = RESPONSE_DESCRIBE_TASKS
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+    running_count = action.get_running_tasks_count(service, [TASK_ARN_1, TASK_ARN_2])
+    assert running_count == 2
+    client.describe_tasks.assert_called_once_with(cluster_name=CLUSTER_NAME, task_arns=[TASK_ARN_1, TASK_ARN_2])
+    thread_pool_executor.assert_not_called()
+
+
+@patch.object(EcsClient, '__init__')
+def test_get_running_tasks_count_in_batches(client, service):
+    client.describe_tasks.return_value = RESPONSE_DESCRIBE_TASKS
+    action = EcsAction(client, CLUSTER_NAME, SERVICE_NAME)
+    task_arns = [TASK_ARN_1] * 250
+    running_count = action.get_running_tasks_count(service, task_arns)
+    assert running_count == 6
+    assert client.describe_tasks.call_count == 3
+    for call in client.describe_tasks.call_args_list:
+        assert len(call[1]['task_arns']) <= 100
+
+
 @patch.object(EcsClient, '__init__')
 def test_get_running_tasks_count_new_revision(client, service, task_definition_revision_2):
     client.describe_tasks.return_value = RESPONSE_DESCRIBE_TASKS
@@ -799,3 +991,24 @@ def test_ecs_server_get_warnings():
     })
 
     assert len(service.get_warnings(since, until)) == 1
+
+
+def test_ecs_server_get_warnings_stops_at_older_events():
+    now = datetime.now()
+    since = now - timedelta(hours=1)
+    until = now + timedelta(hours=1)
+
+    events = [
+        {u'createdAt': now, u'message': u'unable to foo'},
+        {u'createdAt': now - timedelta(hours=2), u'message': u'unable to bar'},
+        {u'createdAt': now - timedelta(minutes=30), u'message': u'unable to baz'},
+    ]
+
+    service = EcsService('foo', {
+        u'deployments': [],
+        u'events': events,
+    })
+
+    warnings = service.get_warnings(since, until)
+    assert list(warnings.values()) == [u'unable to foo']
+    assert service.get_warnings(since, until) is warnings